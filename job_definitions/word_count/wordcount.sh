@@ -3,12 +3,19 @@
 set -e
 set -o pipefail
 
+# Array jobs look up their input file in a manifest, one key per line
+if [ -n "$MANIFEST" ]; then
+    S3_INPUT_OBJECT=$(aws s3 cp "$MANIFEST" - | sed -n "$((AWS_BATCH_JOB_ARRAY_INDEX+1))p")
+fi
+
 date
 echo ==============================================
 echo "Args: $@"
 echo "jobId: $AWS_BATCH_JOB_ID"
 echo "jobQueue: $AWS_BATCH_JQ_NAME"
 echo "computeEnvironment: $AWS_BATCH_CE_NAME"
+echo "manifest: $MANIFEST"
+echo "arrayIndex: $AWS_BATCH_JOB_ARRAY_INDEX"
 echo "inputFile: $S3_INPUT_OBJECT"
 echo "inputBucket: $S3_INPUT_BUCKET"
 echo "outputBucket: $S3_OUTPUT_BUCKET"
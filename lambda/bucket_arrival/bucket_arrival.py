@@ -1,37 +1,208 @@
+from aws_clients import batch, client_config
 import boto3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
 import os
 import re
-import pprint
+import threading
+import time
+import uuid
 
-batch = boto3.client("batch")
+# Number of jobs submitted concurrently; the connection pool of the shared
+# clients must be at least this large.
+MAX_WORKERS = 25
+
+# This function's share of the Batch SubmitJob quota, in calls per second.
+# The stack divides the quota between the functions which may run at once.
+SUBMIT_RATE = float(os.environ.get("SUBMIT_RATE", "45"))
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+
+# Where to submit jobs and place output, read once per container
+OUTPUT_BUCKET = os.environ["OUTPUT_BUCKET"]
+JOBQUEUE = os.environ["JOBQUEUE"]
+JOBDEF = os.environ["JOBDEF"]
+
+# Environment shared by every job; extend it rather than modifying it
+JOB_ENVIRONMENT = [{"name": "S3_OUTPUT_BUCKET", "value": OUTPUT_BUCKET}]
+
+# Batch array jobs can have at most this many children
+MAX_ARRAY_SIZE = 10000
+
+# Number of recently submitted objects remembered by each container
+SEEN_MAX = 4096
+
+# The Batch client comes from the shared layer; the S3 client uses the same
+# configuration
+s3 = boto3.client("s3", config=client_config)
+
+# Job names can only be a maximum length and consist of a subset
+# of characters
+JOBNAME_RE = re.compile(r"[^a-zA-Z0-9_-]+")
+
+
+def job_name(obj_key):
+    return JOBNAME_RE.sub("_", obj_key)[:127]
+
+
+class TokenBucket:
+    """Limits callers of take() to a steady number of calls per second"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+limiter = TokenBucket(SUBMIT_RATE)
+
+# S3 and SQS may both deliver the same notification more than once.  Events
+# already submitted by this container are remembered, least recently used
+# first, so that duplicates don't create duplicate jobs.  Each upload has
+# its own S3 sequencer, so uploading identical content again is not a
+# duplicate.
+seen = OrderedDict()
+seen_lock = threading.Lock()
+
+
+def first_sighting(object_id):
+    with seen_lock:
+        if object_id in seen:
+            seen.move_to_end(object_id)
+            return False
+        seen[object_id] = True
+        if len(seen) > SEEN_MAX:
+            seen.popitem(last=False)
+        return True
 
-def handler(event, context):
-    obj_key = event["Records"][0]["s3"]["object"]["key"]
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
 
-    job_environment = [
-        {"name": "S3_OUTPUT_BUCKET", "value": os.environ["OUTPUT_BUCKET"]},
+def forget(object_id):
+    with seen_lock:
+        seen.pop(object_id, None)
+
+
+def submit_job(bucket, obj_key):
+    job_environment = JOB_ENVIRONMENT + [
         {"name": "S3_INPUT_BUCKET", "value": bucket},
         {"name": "S3_INPUT_OBJECT", "value": obj_key},
     ]
 
+    logger.debug("submitting job key=%s bucket=%s jobDefinition=%s", obj_key, bucket, JOBDEF)
+
+    limiter.take()
+    job = batch.submit_job(
+        jobName=job_name(obj_key),
+        jobQueue=JOBQUEUE,
+        jobDefinition=JOBDEF,
+        containerOverrides={"environment": job_environment},
+    )
+    logger.info("submitted jobId=%s jobName=%s key=%s bucket=%s", job["jobId"], job["jobName"], obj_key, bucket)
+    return job
+
+
+def submit_array_job(bucket, obj_keys):
+    # Child jobs find their input file by looking up their array index in a
+    # manifest of keys, one per line
+    manifest_key = f"manifests/{uuid.uuid4()}.txt"
+    s3.put_object(Bucket=OUTPUT_BUCKET, Key=manifest_key, Body="\n".join(obj_keys).encode())
+    manifest = f"s3://{OUTPUT_BUCKET}/{manifest_key}"
+
+    job_environment = JOB_ENVIRONMENT + [
+        {"name": "S3_INPUT_BUCKET", "value": bucket},
+        {"name": "MANIFEST", "value": manifest},
+    ]
+
+    logger.debug(
+        "submitting array job size=%d bucket=%s manifest=%s jobDefinition=%s", len(obj_keys), bucket, manifest, JOBDEF
+    )
+
+    limiter.take()
+    job = batch.submit_job(
+        jobName=job_name(manifest_key),
+        jobQueue=JOBQUEUE,
+        jobDefinition=JOBDEF,
+        arrayProperties={"size": len(obj_keys)},
+        containerOverrides={"environment": job_environment},
+    )
+    logger.info(
+        "submitted array jobId=%s jobName=%s size=%d bucket=%s manifest=%s",
+        job["jobId"],
+        job["jobName"],
+        len(obj_keys),
+        bucket,
+        manifest,
+    )
+    return job
+
+
+def submit_files(bucket, files):
+    # files is a list of (message_id, obj_key, object_id) tuples.  Array
+    # jobs need at least two children, so a lone file gets an ordinary job.
     try:
-        jobDef = os.environ["JOBDEF"]
-        print(f"submitting job for file {obj_key} in bucket {bucket}\n")
-        print(f"job definition {jobDef}\n")
-
-        job = batch.submit_job(
-            # Job names can only be a maximum length and consist of a subset
-            # of characters
-            jobName=re.sub(r"[^a-zA-Z0-9_-]+", "_", obj_key)[:127],
-            jobQueue=os.environ["JOBQUEUE"],
-            jobDefinition=jobDef,
-            containerOverrides={"environment": job_environment},
-        )
-        response = {"status": "success", "key": obj_key, "job": job}
-        pprint.pp({"Response": response})
-        return response
-    except Exception as e:
-        print(e)
-        print(f"Error submitting job for file {obj_key} in bucket {bucket}\n")
-        raise e
+        if len(files) == 1:
+            submit_job(bucket, files[0][1])
+        else:
+            submit_array_job(bucket, [obj_key for _, obj_key, _ in files])
+        return []
+    except Exception:
+        # Allow the retried messages to submit the jobs
+        for _, _, object_id in files:
+            forget(object_id)
+        logger.exception("submit_failed files=%d bucket=%s", len(files), bucket)
+        return [message_id for message_id, _, _ in files]
+
+
+def handler(event, context):
+    # Each SQS message carries an S3 notification, which may itself
+    # contain several records.  Files are grouped by bucket, so that each
+    # group can be submitted as a single array job.
+    by_bucket = {}
+    failed = set()
+    for message in event["Records"]:
+        try:
+            # S3 sends an s3:TestEvent with no Records when the
+            # notification is first configured
+            for record in json.loads(message["body"]).get("Records", []):
+                obj_key = record["s3"]["object"]["key"]
+                bucket = record["s3"]["bucket"]["name"]
+                s3_object = record["s3"]["object"]
+                object_id = (bucket, obj_key, s3_object.get("eTag"), s3_object.get("size"), s3_object.get("sequencer"))
+                if not first_sighting(object_id):
+                    logger.info("skipping duplicate key=%s bucket=%s", obj_key, bucket)
+                    continue
+                by_bucket.setdefault(bucket, []).append((message["messageId"], obj_key, object_id))
+        except Exception:
+            logger.exception("unreadable message messageId=%s", message["messageId"])
+            failed.add(message["messageId"])
+
+    groups = [
+        (bucket, files[i : i + MAX_ARRAY_SIZE])
+        for bucket, files in by_bucket.items()
+        for i in range(0, len(files), MAX_ARRAY_SIZE)
+    ]
+
+    # Submit in parallel so that API round trips overlap, sharing the
+    # clients and rate limiter
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for message_ids in executor.map(lambda g: submit_files(*g), groups):
+            failed.update(message_ids)
+
+    # Failed messages are reported back to SQS individually so that only
+    # they are retried.
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed]}
@@ -1,23 +1,29 @@
-import boto3
+import logging
 import os
-import pprint
 
-batch = boto3.client("batch")
+# Use the shared client if the aws_clients layer is attached
+try:
+    from aws_clients import batch
+except ImportError:
+    import boto3
+
+    batch = boto3.client("batch")
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
 def handler(event, context):
     jobQueue=os.environ["JOBQUEUE"]
     try:
-        print(f"Budget exceeded, inactivating {jobQueue}\n")
-        pprint.pp(event)
+        logger.info("Budget exceeded, inactivating %s", jobQueue)
+        logger.info("event=%s", event)
 
         batch.update_job_queue(
             jobQueue=jobQueue,
             state='DISABLED'
         )
-        response = {"status": "success"}
-        pprint.pp({"Response": response})
-        return response
-    except Exception as e:
-        print(e)
-        print(f"Error disabling queue {jobQueue}\n")
-        raise e
+        return {"status": "success"}
+    except Exception:
+        # Re-raise so that the SNS invocation is retried
+        logger.exception("Error disabling queue %s", jobQueue)
+        raise
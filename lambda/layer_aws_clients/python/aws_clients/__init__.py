@@ -0,0 +1,22 @@
+import boto3
+from botocore.config import Config
+
+# Clients shared by the stack's lambda functions.  They are created once per
+# container, during the init phase, and reused by warm invocations, keeping
+# their connections open.  Adaptive retries back off when we hit the Batch
+# API rate limits.
+#
+# SubmitJob has no idempotency token, so a call retried after a read
+# timeout may create a duplicate job; the read timeout is long enough that
+# this should only happen if the endpoint is stuck.  With these settings a
+# single call takes at most about 3 x (2s + 15s) plus 3s of backoff, under
+# a minute, which BucketArrival's function timeout allows for twice over.
+client_config = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 3},
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=15,
+)
+
+batch = boto3.client("batch", config=client_config)
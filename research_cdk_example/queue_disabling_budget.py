@@ -1,3 +1,5 @@
+from typing import Optional
+
 from constructs import Construct
 from aws_cdk import (
     CfnParameter,
@@ -11,6 +13,35 @@ from aws_cdk import (
     aws_iam as _iam,
 )
 
+
+def _make_budget(name: str, limit: float, cost_tag_value: str) -> _budgets.CfnBudget.BudgetDataProperty:
+    # A monthly cost budget covering resources tagged with cost_tag_value
+    return _budgets.CfnBudget.BudgetDataProperty(
+        budget_name=name,
+        budget_type="COST",
+        time_unit="MONTHLY",
+        budget_limit=_budgets.CfnBudget.SpendProperty(amount=limit, unit="USD"),
+        cost_filters={"TagKeyValue": [cost_tag_value]},
+    )
+
+
+def _make_notification(email: str, topic_arn: str) -> _budgets.CfnBudget.NotificationWithSubscribersProperty:
+    # Notify both the email address and the topic when actual spend
+    # exceeds 95% of the budget
+    return _budgets.CfnBudget.NotificationWithSubscribersProperty(
+        notification=_budgets.CfnBudget.NotificationProperty(
+            comparison_operator="GREATER_THAN",
+            notification_type="ACTUAL",
+            threshold=95,
+            threshold_type="PERCENTAGE",
+        ),
+        subscribers=[
+            _budgets.CfnBudget.SubscriberProperty(subscription_type="EMAIL", address=email),
+            _budgets.CfnBudget.SubscriberProperty(subscription_type="SNS", address=topic_arn),
+        ],
+    )
+
+
 # This construct is an L3 construct which creates a Budget which:
 #     * Emails the user when the budget reaches 95%
 #     * Optionally disables a queue so that no further work can be submitted
@@ -39,46 +70,33 @@ class QueueDisablingBudget(Construct):
             )
         )
 
-        # Create the budget itself
+        # Create the budget itself.  The budget only applies to this stack
         _budgets.CfnBudget(
             self,
             "Budget",
-            budget=_budgets.CfnBudget.BudgetDataProperty(
-                budget_name=f"{stack.stack_name}Budget",
-                budget_type="COST",
-                time_unit="MONTHLY",
-                budget_limit=_budgets.CfnBudget.SpendProperty(amount=budgetlimit.value_as_number, unit="USD"),
-                # The budget only applies to this stack:
-                cost_filters={"TagKeyValue": [f"user:{cost_tag}${stack.node.addr}"]},
+            budget=_make_budget(
+                f"{stack.stack_name}Budget",
+                budgetlimit.value_as_number,
+                f"user:{cost_tag}${stack.node.addr}",
             ),
-            notifications_with_subscribers=[
-                _budgets.CfnBudget.NotificationWithSubscribersProperty(
-                    notification=_budgets.CfnBudget.NotificationProperty(
-                        comparison_operator="GREATER_THAN",
-                        notification_type="ACTUAL",
-                        threshold=95,
-                        threshold_type="PERCENTAGE",
-                    ),
-                    subscribers=[
-                        _budgets.CfnBudget.SubscriberProperty(subscription_type="EMAIL", address=email),
-                        _budgets.CfnBudget.SubscriberProperty(
-                            subscription_type="SNS", address=self.budget_topic.topic_arn
-                        ),
-                    ],
-                )
-            ],
+            notifications_with_subscribers=[_make_notification(email, self.budget_topic.topic_arn)],
         )
 
         CfnOutput(self, "BudgetAlertTopic", value=self.budget_topic.topic_name)
 
-    def disable_jobqueue_on_alert(self, job_queue: _batch.JobQueue):
-        # This lambda function will inactivate the queue, preventing further jobs from arriving
+    def disable_jobqueue_on_alert(
+        self, job_queue: _batch.JobQueue, aws_clients_layer: Optional[_lambda.ILayerVersion] = None
+    ):
+        # This lambda function will inactivate the queue, preventing further jobs from arriving.
+        # If given, aws_clients_layer supplies its Batch client; otherwise it creates its own.
         budget_alert_function = _lambda.Function(
             self,
             "BudgetExceeded",
-            runtime=_lambda.Runtime.PYTHON_3_9,
-            code=_lambda.Code.from_asset("lambda/budget_exceeded"),
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            architecture=_lambda.Architecture.ARM_64,
+            code=_lambda.Code.from_asset("lambda/budget_exceeded", exclude=["__pycache__"]),
             handler="budget_exceeded.handler",
+            layers=[aws_clients_layer] if aws_clients_layer else None,
             environment={
                 "JOBQUEUE": job_queue.job_queue_name,
             },
@@ -8,11 +8,14 @@ from aws_cdk import (
     aws_s3 as _s3,
     aws_s3_notifications as _s3n,
     aws_lambda as _lambda,
+    aws_lambda_event_sources as _les,
+    aws_sqs as _sqs,
     aws_batch as _batch,
     aws_ec2 as _ec2,
     aws_ecs as _ecs,
     aws_iam as _iam,
     aws_sns as _sns,
+    aws_sns_subscriptions as _subs,
     aws_events as _events,
     aws_events_targets as _targets,
 )
@@ -21,6 +24,11 @@ from .queue_disabling_budget import QueueDisablingBudget
 
 COST_TAG="research-stack-id"
 
+# Batch allows 50 SubmitJob calls per second; the bucket arrival functions
+# between them stay a little under that
+SUBMIT_JOB_RATE = 45
+ARRIVAL_CONCURRENCY = 10
+
 class ResearchCdkExampleStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -79,34 +87,92 @@ class ResearchCdkExampleStack(Stack):
             auto_delete_objects=True,
         )
 
+        # Array job manifests are only needed until the jobs have read
+        # them, so they are cleaned up after a week, including any left by
+        # failed submissions
         output_bucket = _s3.Bucket(
             self,
             "OutputBucket",
             encryption=_s3.BucketEncryption.S3_MANAGED,
             removal_policy=RemovalPolicy.DESTROY,
             auto_delete_objects=True,
+            lifecycle_rules=[_s3.LifecycleRule(prefix="manifests/", expiration=Duration.days(7))],
+        )
+
+        # Create a layer providing preconfigured AWS clients to the lambda
+        # functions
+        aws_clients_layer = _lambda.LayerVersion(
+            self,
+            "AwsClientsLayer",
+            code=_lambda.Code.from_asset("lambda/layer_aws_clients", exclude=["__pycache__"]),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_12],
+            compatible_architectures=[_lambda.Architecture.ARM_64],
         )
 
         # Create the lambda function which will respond to files arriving
         bucket_arrival_function = _lambda.Function(
             self,
             "BucketArrival",
-            runtime=_lambda.Runtime.PYTHON_3_9,
-            code=_lambda.Code.from_asset("lambda/bucket_arrival"),
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            architecture=_lambda.Architecture.ARM_64,
+            code=_lambda.Code.from_asset("lambda/bucket_arrival", exclude=["__pycache__"]),
             handler="bucket_arrival.handler",
+            layers=[aws_clients_layer],
+            # Long enough for the Batch and S3 calls to use all their
+            # retries; see the aws_clients layer
+            timeout=Duration.minutes(3),
             # Environment variables tell the lambda where to submit jobs
             # and place output
             environment={
                 "JOBDEF": job_def.job_definition_arn,
                 "JOBQUEUE": job_queue.job_queue_name,
                 "OUTPUT_BUCKET": output_bucket.bucket_name,
+                # Each concurrent function gets an equal share of the
+                # SubmitJob rate
+                "SUBMIT_RATE": str(SUBMIT_JOB_RATE / ARRIVAL_CONCURRENCY),
+                # Set to DEBUG to log every submission in detail
+                "LOG_LEVEL": "INFO",
             },
         )
 
-        # Send object creation notifications from the input bucket
-        # to the lambda function
+        # Publish object creation notifications from the input bucket to a
+        # topic, and queue them from there so that a burst of arrivals is
+        # handled by a few lambda invocations rather than one per file.
+        # Notifications which repeatedly fail end up in the dead letter
+        # queue.  The visibility timeout should be six times the function
+        # timeout.
+        arrival_topic = _sns.Topic(self, "ArrivalTopic")
+
+        # Dead-lettered messages keep their original enqueue time, so keep
+        # them for the maximum fourteen days rather than the default four
+        arrival_dlq = _sqs.Queue(self, "ArrivalDLQ", retention_period=Duration.days(14))
+
+        arrival_queue = _sqs.Queue(
+            self,
+            "ArrivalQueue",
+            visibility_timeout=Duration.minutes(18),
+            dead_letter_queue=_sqs.DeadLetterQueue(max_receive_count=5, queue=arrival_dlq),
+        )
+
         input_bucket.add_object_created_notification(
-            _s3n.LambdaDestination(bucket_arrival_function),
+            _s3n.SnsDestination(arrival_topic),
+        )
+
+        # Raw delivery leaves the S3 notification as the message body
+        arrival_topic.add_subscription(
+            _subs.SqsSubscription(arrival_queue, raw_message_delivery=True),
+        )
+
+        # Limit how many batches are processed at once, so that the
+        # functions' shares of the SubmitJob rate add up to SUBMIT_JOB_RATE
+        bucket_arrival_function.add_event_source(
+            _les.SqsEventSource(
+                arrival_queue,
+                batch_size=500,
+                max_batching_window=Duration.seconds(20),
+                max_concurrency=ARRIVAL_CONCURRENCY,
+                report_batch_item_failures=True,
+            )
         )
 
         # Allow lambda function to submit jobs
@@ -117,6 +183,11 @@ class ResearchCdkExampleStack(Stack):
         input_bucket.grant_read(job_role)
         output_bucket.grant_write(job_role)
 
+        # Array jobs list their input files in manifests, written by the
+        # lambda and read by the jobs
+        output_bucket.grant_put(bucket_arrival_function, "manifests/*")
+        output_bucket.grant_read(job_role, "manifests/*")
+
         # Specify email destination as parameter
         email = CfnParameter(
             self,
@@ -153,11 +224,12 @@ class ResearchCdkExampleStack(Stack):
         budget = QueueDisablingBudget(
             self, "StackBudget", email=email.value_as_string, cost_tag=COST_TAG
         )
-        budget.disable_jobqueue_on_alert(job_queue)
+        budget.disable_jobqueue_on_alert(job_queue, aws_clients_layer)
 
         Tags.of(self).add(key=COST_TAG, value=self.node.addr)
 
         # Print out the bucket names
         CfnOutput(self, "InputBucketName", value=input_bucket.bucket_name)
         CfnOutput(self, "OutputBucketName", value=output_bucket.bucket_name)
-        CfnOutput(self, "QueueName", value=job_queue.job_queue_name)
\ No newline at end of file
+        CfnOutput(self, "QueueName", value=job_queue.job_queue_name)
+        CfnOutput(self, "ArrivalDLQName", value=arrival_dlq.queue_name)
\ No newline at end of file
@@ -0,0 +1,14 @@
+import aws_cdk as core
+import aws_cdk.assertions as assertions
+import pytest
+
+from research_cdk_example.research_cdk_example_stack import ResearchCdkExampleStack
+
+
+# Synthesising the stack is the slow part of each test, so do it once and
+# share the template between tests
+@pytest.fixture(scope="session")
+def template():
+    app = core.App()
+    stack = ResearchCdkExampleStack(app, "research-cdk-example")
+    return assertions.Template.from_stack(stack)
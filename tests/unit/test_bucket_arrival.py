@@ -0,0 +1,154 @@
+import importlib
+import json
+import sys
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+# Tests for the BucketArrival lambda handler.  The AWS clients are replaced
+# by stubs, so these tests need neither boto3 nor AWS credentials.
+
+ROOT = Path(__file__).parents[2]
+
+
+class StubBatch:
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    def submit_job(self, **kwargs):
+        if self.fail:
+            raise RuntimeError("SubmitJob failed")
+        self.calls.append(kwargs)
+        return {"jobId": str(len(self.calls)), "jobName": kwargs["jobName"]}
+
+
+class StubS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[f"s3://{Bucket}/{Key}"] = Body
+
+
+@pytest.fixture
+def bucket_arrival(monkeypatch):
+    batch = StubBatch()
+    s3 = StubS3()
+    monkeypatch.setitem(sys.modules, "aws_clients", types.SimpleNamespace(batch=batch, client_config=None))
+    monkeypatch.setitem(sys.modules, "boto3", types.SimpleNamespace(client=lambda *args, **kwargs: s3))
+    monkeypatch.syspath_prepend(str(ROOT / "lambda" / "bucket_arrival"))
+    monkeypatch.setenv("OUTPUT_BUCKET", "output")
+    monkeypatch.setenv("JOBQUEUE", "queue")
+    monkeypatch.setenv("JOBDEF", "jobdef")
+
+    # Import afresh, so that each test starts with an empty duplicate cache
+    monkeypatch.delitem(sys.modules, "bucket_arrival", raising=False)
+    yield importlib.import_module("bucket_arrival")
+    sys.modules.pop("bucket_arrival", None)
+
+
+def message(message_id, *keys, bucket="input", sequencer="01"):
+    records = [
+        {"s3": {"bucket": {"name": bucket}, "object": {"key": key, "eTag": key, "size": 1, "sequencer": sequencer}}}
+        for key in keys
+    ]
+    return {"messageId": message_id, "body": json.dumps({"Records": records})}
+
+
+def failures(response):
+    return sorted(item["itemIdentifier"] for item in response["batchItemFailures"])
+
+
+def test_unreadable_message_reported(bucket_arrival):
+    event = {"Records": [{"messageId": "1", "body": "not json"}, message("2", "a.txt")]}
+
+    assert failures(bucket_arrival.handler(event, None)) == ["1"]
+    assert len(bucket_arrival.batch.calls) == 1
+
+
+def test_test_event_skipped(bucket_arrival):
+    event = {"Records": [{"messageId": "1", "body": json.dumps({"Event": "s3:TestEvent"})}]}
+
+    assert failures(bucket_arrival.handler(event, None)) == []
+    assert bucket_arrival.batch.calls == []
+
+
+def test_single_file_submits_job(bucket_arrival):
+    assert failures(bucket_arrival.handler({"Records": [message("1", "dir/a file.txt")]}, None)) == []
+
+    [call] = bucket_arrival.batch.calls
+    assert "arrayProperties" not in call
+    assert call["jobName"] == "dir_a_file_txt"
+    assert call["jobQueue"] == "queue"
+    assert call["jobDefinition"] == "jobdef"
+    assert {"name": "S3_INPUT_OBJECT", "value": "dir/a file.txt"} in call["containerOverrides"]["environment"]
+
+
+def test_several_files_submit_array_job(bucket_arrival):
+    event = {"Records": [message("1", "a.txt", "b.txt"), message("2", "c.txt")]}
+
+    assert failures(bucket_arrival.handler(event, None)) == []
+
+    [call] = bucket_arrival.batch.calls
+    assert call["arrayProperties"] == {"size": 3}
+    environment = {e["name"]: e["value"] for e in call["containerOverrides"]["environment"]}
+    assert environment["S3_INPUT_BUCKET"] == "input"
+    assert bucket_arrival.s3.objects[environment["MANIFEST"]] == b"a.txt\nb.txt\nc.txt"
+
+
+def test_failed_submission_reported_and_retried(bucket_arrival):
+    event = {"Records": [message("1", "a.txt"), message("2", "b.txt")]}
+
+    bucket_arrival.batch.fail = True
+    assert failures(bucket_arrival.handler(event, None)) == ["1", "2"]
+
+    # The failed files are not treated as duplicates when SQS redelivers them
+    bucket_arrival.batch.fail = False
+    assert failures(bucket_arrival.handler(event, None)) == []
+    assert bucket_arrival.batch.calls[0]["arrayProperties"] == {"size": 2}
+
+
+def test_redelivered_event_skipped(bucket_arrival):
+    bucket_arrival.handler({"Records": [message("1", "a.txt")]}, None)
+
+    assert failures(bucket_arrival.handler({"Records": [message("2", "a.txt")]}, None)) == []
+    assert len(bucket_arrival.batch.calls) == 1
+
+
+def test_new_upload_of_same_content_submitted(bucket_arrival):
+    bucket_arrival.handler({"Records": [message("1", "a.txt", sequencer="01")]}, None)
+
+    assert failures(bucket_arrival.handler({"Records": [message("2", "a.txt", sequencer="02")]}, None)) == []
+    assert len(bucket_arrival.batch.calls) == 2
+
+
+@pytest.mark.parametrize(
+    "key, name",
+    [
+        ("plain-key_1", "plain-key_1"),
+        ("dir/file.txt", "dir_file_txt"),
+        ("a  //..b", "a_b"),
+        ("a_/b", "a__b"),
+        ("caf\u00e9.txt", "caf_txt"),
+        ("x" * 200, "x" * 127),
+    ],
+)
+def test_job_name(bucket_arrival, key, name):
+    assert bucket_arrival.job_name(key) == name
+
+
+def test_token_bucket_limits_rate(bucket_arrival):
+    limiter = bucket_arrival.TokenBucket(20)
+
+    # A full bucket allows a burst, after which callers wait for tokens
+    start = time.monotonic()
+    for _ in range(20):
+        limiter.take()
+    assert time.monotonic() - start < 0.04
+
+    for _ in range(5):
+        limiter.take()
+    assert time.monotonic() - start >= 0.2
@@ -1,17 +1,11 @@
-import aws_cdk as core
 import aws_cdk.assertions as assertions
 
-from research_cdk_example.research_cdk_example_stack import ResearchCdkExampleStack
-
 # example tests. To run these tests, install the dev requirements
-# and then run "pytest" in the project root
-
+# and then run "pytest" in the project root. The template fixture is
+# defined in conftest.py
 
-def test_resources_created():
-    app = core.App()
-    stack = ResearchCdkExampleStack(app, "research-cdk-example")
-    template = assertions.Template.from_stack(stack)
 
+def test_resources_created(template):
     template.resource_count_is("AWS::S3::Bucket", 2)
 
     template.has_resource_properties("AWS::SNS::Subscription", {"Protocol": "email"})
@@ -21,4 +15,65 @@ def test_resources_created():
     template.resource_count_is("AWS::Batch::JobQueue", 1)
     template.resource_count_is("AWS::Batch::ComputeEnvironment", 1)
     template.resource_count_is("AWS::Budgets::Budget", 1)
-    template.resource_count_is("AWS::SNS::Topic", 2)
+    template.resource_count_is("AWS::SNS::Topic", 3)
+
+    template.resource_count_is("AWS::Lambda::LayerVersion", 1)
+
+    # Both BucketArrival and BudgetExceeded
+    template.resource_properties_count_is(
+        "AWS::Lambda::Function", {"Runtime": "python3.12", "Architectures": ["arm64"]}, 2
+    )
+
+
+def test_sqs_queue_created(template):
+    template.resource_count_is("AWS::SQS::Queue", 2)
+
+    template.has_resource_properties("AWS::SQS::Queue", {"MessageRetentionPeriod": 1209600})
+
+    template.has_resource_properties("AWS::SNS::Subscription", {"Protocol": "sqs", "RawMessageDelivery": True})
+
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 500,
+            "MaximumBatchingWindowInSeconds": 20,
+            "ScalingConfig": {"MaximumConcurrency": 10},
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        },
+    )
+
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {"Environment": {"Variables": assertions.Match.object_like({"SUBMIT_RATE": "4.5"})}},
+    )
+
+
+def test_manifests(template):
+    # BucketArrival may write array job manifests, which expire
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": assertions.Match.array_with(
+                    [
+                        assertions.Match.object_like(
+                            {
+                                "Action": assertions.Match.array_with(["s3:PutObject"]),
+                                "Resource": {"Fn::Join": ["", [assertions.Match.any_value(), "/manifests/*"]]},
+                            }
+                        )
+                    ]
+                )
+            },
+            "Roles": [{"Ref": assertions.Match.string_like_regexp("BucketArrival")}],
+        },
+    )
+
+    template.has_resource_properties(
+        "AWS::S3::Bucket",
+        {
+            "LifecycleConfiguration": {
+                "Rules": [{"Prefix": "manifests/", "ExpirationInDays": 7, "Status": "Enabled"}],
+            },
+        },
+    )